@@ -1,29 +1,24 @@
+import bisect
 import sigrokdecode as srd
 from collections import deque
 
 class SamplerateError(Exception):
     pass
 
+# Lower bounds of abs(t) with (scale, unit) for each time/frequency range
+TIME_THRESHOLDS = (1e-9, 1e-6, 1e-3, 1.0)
+TIME_UNITS = ((1e9, 'ns'), (1e6, 'μs'), (1e3, 'ms'), (1.0, 's '))
+FREQ_THRESHOLDS = (1e3, 1e6, 1e9)
+FREQ_UNITS = ((1.0, 'Hz'), (1e-3, 'kHz'), (1e-6, 'MHz'), (1e-9, 'GHz'))
+
 def normalize_time(t):
-    if abs(t) >= 1.0:
-        return '%.3f s  (%.3f Hz)' % (t, (1/t))
-    elif abs(t) >= 0.001:
-        if 1/t/1000 < 1:
-            return '%.3f ms (%.3f Hz)' % (t * 1000.0, (1/t))
-        else:
-            return '%.3f ms (%.3f kHz)' % (t * 1000.0, (1/t)/1000)
-    elif abs(t) >= 0.000001:
-        if 1/t/1000/1000 < 1:
-            return '%.3f μs (%.3f kHz)' % (t * 1000.0 * 1000.0, (1/t)/1000)
-        else:
-            return '%.3f μs (%.3f MHz)' % (t * 1000.0 * 1000.0, (1/t)/1000/1000)
-    elif abs(t) >= 0.000000001:
-        if 1/t/1000/1000/1000:
-            return '%.3f ns (%.3f MHz)' % (t * 1000.0 * 1000.0 * 1000.0, (1/t)/1000/1000)
-        else:
-            return '%.3f ns (%.3f GHz)' % (t * 1000.0 * 1000.0 * 1000.0, (1/t)/1000/1000/1000)
-    else:
+    i = bisect.bisect_right(TIME_THRESHOLDS, abs(t))
+    if i == 0:
         return '%f' % t
+    t_scale, t_unit = TIME_UNITS[i - 1]
+    f = 1 / t
+    f_scale, f_unit = FREQ_UNITS[bisect.bisect_right(FREQ_THRESHOLDS, abs(f))]
+    return '%.3f %s (%.3f %s)' % (t * t_scale, t_unit, f * f_scale, f_unit)
 
 class Decoder(srd.Decoder):
     api_version = 3
@@ -65,19 +60,80 @@ class Decoder(srd.Decoder):
 
     def reset(self):
         self.samplerate = None
-        self.last_n = deque()
+        # Ring buffer of last pulse widths in samples, allocated in start()
+        self.last_n = []
+        self.head = 0
+        self.n_last = 0
+        # Running sums of last_n, exact as these are integer sample counts
+        self.pushed = 0
+        self.sum_n = 0
+        self.sumsq_n = 0
+        # Monotonic queues of (samples, idx) with current min/max at the front
+        self.min_dq = deque()
+        self.max_dq = deque()
         self.chunks = 0
         self.level_changed = False
         self.last_sample0 = None
         self.last_t = None
         self.count = 0
 
+    def push_samples(self, samples):
+        if self.n_last == len(self.last_n):
+            self.pop_samples()
+
+        idx = self.pushed
+        self.pushed += 1
+        self.last_n[(self.head + self.n_last) % len(self.last_n)] = samples
+        self.n_last += 1
+        self.sum_n += samples
+        self.sumsq_n += samples * samples
+
+        while self.min_dq and self.min_dq[-1][0] > samples:
+            self.min_dq.pop()
+        self.min_dq.append((samples, idx))
+        while self.max_dq and self.max_dq[-1][0] < samples:
+            self.max_dq.pop()
+        self.max_dq.append((samples, idx))
+
+    def pop_samples(self):
+        idx = self.pushed - self.n_last
+        samples = self.last_n[self.head]
+        self.head = (self.head + 1) % len(self.last_n)
+        self.n_last -= 1
+        self.sum_n -= samples
+        self.sumsq_n -= samples * samples
+
+        if self.min_dq[0][1] == idx:
+            self.min_dq.popleft()
+        if self.max_dq[0][1] == idx:
+            self.max_dq.popleft()
+
     def metadata(self, key, value):
         if key == srd.SRD_CONF_SAMPLERATE:
             self.samplerate = value
 
     def start(self):
         self.out_ann = self.register(srd.OUTPUT_ANN)
+        self.avg_period = int(self.options['avg_period'])
+        self.show_count = self.options['show_count'] == 'yes'
+        self.show_other = self.options['show_other'] == 'yes'
+        self.last_n = [0] * self.avg_period
+        # Annotation data lists reused between put() calls
+        self.ann_data = [[i, [None]] for i in range(len(self.annotations))]
+        # Last (value, text) of each time annotation, window min/max rarely change between edges
+        self.ann_cache = [(None, None)] * len(self.annotations)
+
+    def put_ann(self, ss, es, ann, text):
+        data = self.ann_data[ann]
+        data[1][0] = text
+        self.put(ss, es, self.out_ann, data)
+
+    def put_time(self, ss, es, ann, t):
+        cached_t, text = self.ann_cache[ann]
+        if t != cached_t:
+            text = normalize_time(t)
+            self.ann_cache[ann] = (t, text)
+        self.put_ann(ss, es, ann, text)
 
     def decode(self):
         if not self.samplerate:
@@ -87,30 +143,24 @@ class Decoder(srd.Decoder):
             sample0 = self.samplenum
 
             if self.last_sample0 is not None and self.last_t is not None:
-                mean = None
-                self.put(self.last_sample0, sample0, self.out_ann,
-                         [0, [normalize_time(self.last_t)]])
+                ss, es = self.last_sample0, sample0
+                n = self.n_last
 
-                if self.options['avg_period'] > 0 and len(self.last_n) > 0:
-                    mean = sum(self.last_n) / len(self.last_n)
-                    self.put(self.last_sample0, sample0, self.out_ann,
-                             [1, [normalize_time(mean)]])
+                self.put_time(ss, es, 0, self.last_t)
 
-                if self.options['show_count'] == 'yes':
-                    self.put(self.last_sample0, sample0, self.out_ann,
-                             [2, [str(self.count)]])
+                if self.avg_period > 0 and n > 0:
+                    self.put_time(ss, es, 1, self.sum_n / n / self.samplerate)
 
-                if self.options['show_other'] == 'yes':
-                    self.put(self.last_sample0, sample0, self.out_ann,
-                             [3, [normalize_time(min(self.last_n))]])
+                if self.show_count:
+                    self.put_ann(ss, es, 2, str(self.count))
 
-                    self.put(self.last_sample0, sample0, self.out_ann,
-                             [4, [normalize_time(max(self.last_n))]])
+                if self.show_other and n > 0:
+                    self.put_time(ss, es, 3, self.min_dq[0][0] / self.samplerate)
+                    self.put_time(ss, es, 4, self.max_dq[0][0] / self.samplerate)
 
-                    if mean is not None and len(self.last_n) > 1:
-                        std = 1 / (len(self.last_n) - 1) * sum((t - mean)**2 for t in self.last_n)
-                        self.put(self.last_sample0, sample0, self.out_ann,
-                                 [5, [normalize_time(std)]])
+                    if n > 1:
+                        m2 = (n * self.sumsq_n - self.sum_n * self.sum_n) / n
+                        self.put_time(ss, es, 5, m2 / (n - 1) / self.samplerate**2)
 
             self.wait({0: 'f'})
             sample1 = self.samplenum
@@ -118,10 +168,8 @@ class Decoder(srd.Decoder):
             samples = sample1 - sample0
             t = samples / self.samplerate
 
-            if t > 0:
-                self.last_n.append(t)
-            if len(self.last_n) > self.options['avg_period']:
-                self.last_n.popleft()
+            if samples > 0 and self.avg_period > 0:
+                self.push_samples(samples)
 
             self.last_sample0 = sample0
             self.last_t = t